@@ -0,0 +1,92 @@
+#  Copyright (c) 2021.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import os
+from typing import Any
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+__all__ = ['dumps', 'loads', 'DECODE_ERRORS', 'EXTENSION', 'EXTENSIONS']
+
+JSON_EXTENSION = ".json"
+MSGPACK_EXTENSION = ".msgpack"
+
+# extensions of the health check files the collector can read
+EXTENSIONS = (JSON_EXTENSION, MSGPACK_EXTENSION)
+
+# exceptions raised by loads for files that can not be decoded
+DECODE_ERRORS = (ValueError,) if msgpack is None else (ValueError, msgpack.UnpackException)
+
+
+def _dump_extension() -> str:
+	"""
+	Get the extension of the format the health check files are written in,
+	JSON unless MessagePack is asked for with PY_HEALTH_DUMP_FORMAT
+	:return: file extension
+	"""
+	if os.environ.get('PY_HEALTH_DUMP_FORMAT', 'json') != 'msgpack':
+		return JSON_EXTENSION
+	if msgpack is None:
+		logging.warning("PY_HEALTH_DUMP_FORMAT is msgpack but msgpack is not installed, using json")
+		return JSON_EXTENSION
+	return MSGPACK_EXTENSION
+
+
+EXTENSION = _dump_extension()
+
+
+def dumps(obj: Any) -> bytes:
+	"""
+	Serialize a health check message in the format given by EXTENSION.
+	JSON is encoded with orjson if it is installed
+	:param obj: message to serialize
+	:return: encoded message
+	"""
+	if EXTENSION == MSGPACK_EXTENSION:
+		return msgpack.packb(obj)
+	if orjson is not None:
+		try:
+			return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+		except orjson.JSONEncodeError:
+			pass  # e.g. integers beyond 64 bits, which the json module still encodes
+	return json.dumps(obj).encode("utf-8")
+
+
+def loads(data: bytes, extension: str) -> Any:
+	"""
+	Deserialize a health check message
+	:param data: encoded message
+	:param extension: extension of the file the message was read from, which gives its format
+	:return: decoded message
+	"""
+	if extension == MSGPACK_EXTENSION:
+		if msgpack is None:
+			raise RuntimeError("health check file is in MessagePack format but msgpack is not installed")
+		return msgpack.unpackb(data, raw=False, strict_map_key=False)
+	if orjson is not None:
+		try:
+			return orjson.loads(data)
+		except orjson.JSONDecodeError:
+			pass  # e.g. NaN written by the json module fallback of dumps
+	return json.loads(data)
@@ -12,52 +12,54 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import inspect
-import json
 import logging
 import os
+import queue
+import sys
 import threading
 import time
-from functools import reduce
-from typing import Dict, List, Callable, Optional
+from typing import Dict, List, Callable, Optional, Tuple
+
+from healthcheck_python import codec
 
 logger = logging.getLogger(__name__)
 
-RUN_PERIOD = os.environ.get('PY_HEALTH_RUN_PERIOD', 5)
+RUN_PERIOD = float(os.environ.get('PY_HEALTH_RUN_PERIOD', 5))
 
 
-def json_output_handler(prefix: str, results: List, passed: bool, liveness: bool, timeout: int) -> Dict:
+def json_output_handler(  # pylint: disable=too-many-arguments
+		prefix: str, results: List, passed: bool, liveness: bool, timeout: int, *,
+		timestamp: Optional[float] = None
+) -> Dict:
 	"""
 	Create a json output for individual health check process
 	:param results: The output of the health check function
 	:param passed: Overall health check result
 	:param liveness: Liveness check result
+	:param timestamp: Time of the health check cycle, defaults to now
 	:return: json output
 	"""
+	if timestamp is None:
+		timestamp = time.time()
 	data = {
 		'name': prefix,
 		'status': passed,
 		'liveness': liveness,
-		'timestamp': time.time(),
+		'timestamp': timestamp,
 		'timeout': timeout,
 		'results': results,
 	}
 	return data
 
 
-def check_reduce(passed, result):
-	"""
-	Reduce function to check if all the health check functions passed
-	"""
-	return passed and result.get('passed')
-
-
 class HealthCheck(threading.Timer):
 	"""
 	Health check timer function. Runs every interval seconds and calls the health check functions
 	"""
 
-	def __init__(self, prefix: str, interval: int = RUN_PERIOD, timeout: int = 0, args=None, kwargs=None):
+	def __init__(
+			self, prefix: str, interval: float = RUN_PERIOD, timeout: int = 0, args=None, kwargs=None
+	):
 		super().__init__(interval, self.run, args, kwargs)
 		self._stop_event = threading.Event()
 		self.prefix: str = prefix
@@ -65,7 +67,13 @@ class HealthCheck(threading.Timer):
 		self.timeout: int = timeout
 		self._latest_checkin = 0
 		self._liveness: bool = False
-		self._checks = []
+		self._dumped_liveness: Optional[bool] = None
+		self._checks: List[Tuple[Callable, str, str]] = []
+		self._dump_path: Optional[str] = None
+		self._tmp_path: Optional[str] = None
+		# holds only the latest message, a stale one is dropped if the writer falls behind
+		self._writeq: queue.Queue = queue.Queue(maxsize=1)
+		self._writer = threading.Thread(target=self._writer_loop, daemon=True)
 
 		self._dump_dir = os.environ.get('PY_HEALTH_MULTIPROC_DIR', None)
 		if self._dump_dir:
@@ -75,13 +83,18 @@ class HealthCheck(threading.Timer):
 
 			if not os.path.isdir(self._dump_dir):
 				self._dump_dir = None
+				return
+
+			self._dump_path = os.path.join(self._dump_dir, f"{os.getpid()}-{self.prefix}{codec.EXTENSION}")
+			self._tmp_path = self._dump_path + ".tmp"
 
 	def add_check(self, function: Callable) -> None:
 		"""
 		Add a health check function to the list of health check functions
 		:param function: a function that returns a dictionary with the health check results
 		"""
-		self._checks.append(function)
+		name = function.__name__
+		self._checks.append((function, name, f"{self.prefix}.{name}"))
 
 	def stop(self):
 		"""
@@ -99,65 +112,134 @@ class HealthCheck(threading.Timer):
 		"""
 		Start the timer
 		"""
-		while not self._stop_event.is_set():
+		if self._dump_dir:
+			self._writer.start()
+
+		while True:
 			if self._dump_dir:
 				self._check_health()
-			self._stop_event.wait(self.interval)
+			if self._stop_event.wait(self.interval):
+				break
+
+		if self._dump_dir:
+			# let the writer flush the latest message and exit, waiting at most an interval for each
+			try:
+				self._writeq.put(None, timeout=self.interval)
+			except queue.Full:
+				logger.warning("Health check %s writer did not flush the latest message in time", self.prefix)
+			else:
+				self._writer.join(self.interval)
 
 	def _check_health(self) -> None:
 		"""
 		Check health
 		"""
-		results = []
+		# without checks and timeout only the liveness is reported,
+		# so skip the cycles where it has not changed since the last dump
+		if not self._checks and self.timeout <= 0 and self._liveness == self._dumped_liveness:
+			return
+
+		# single wall clock sample shared by the whole cycle
+		now = time.time()
+
 		# check registered health check functions
-		for check in self._checks:
-			results.append(self.run_check(check))
+		results = [self.run_check(check, timestamp=now) for check in self._checks]
 
 		# periodic checkin is only checked if timeout is set
 		if self.timeout > 0:
-			periodic_checkin = self.check_periodic_checkin()
+			periodic_checkin = self.check_periodic_checkin(timestamp=now)
 			results.append(periodic_checkin)
 
-		passed = reduce(check_reduce, results, True)
+		passed = all(result['passed'] for result in results)
 		message = json_output_handler(
 			prefix=self.prefix,
 			results=results, passed=passed,
 			liveness=self._liveness,
-			timeout=self.timeout
+			timeout=self.timeout,
+			timestamp=now
 		)
 
-		# dump to file for collection
-		with open(os.path.join(self._dump_dir, f"{os.getpid()}-{self.prefix}.json"), "w") as json_file:
-			json.dump(message, json_file)
+		try:
+			data = codec.dumps(message)
+		except Exception as exc:
+			logger.error("Health check %s could not be encoded: %s", self.prefix, exc)
+			return
+
+		self._enqueue((data, message['liveness']))
 
-	def run_check(self, check: Callable) -> Dict:
+	def _enqueue(self, item: Tuple[bytes, bool]) -> None:
+		"""
+		Hand over to the writer thread, replacing the message it has not picked up yet
+		:param item: encoded health check message and its liveness
+		"""
+		try:
+			self._writeq.put_nowait(item)
+		except queue.Full:
+			try:
+				self._writeq.get_nowait()
+			except queue.Empty:
+				pass
+			self._writeq.put_nowait(item)
+
+	def _writer_loop(self) -> None:
+		"""
+		Write the health check messages to the dump file until None is received
+		"""
+		while True:
+			item = self._writeq.get()
+			if item is None:
+				break
+			data, liveness = item
+			try:
+				self._dump(data)
+			except Exception as exc:
+				logger.error("Health check %s could not be written: %s", self.prefix, exc)
+				continue
+			self._dumped_liveness = liveness
+
+	def _dump(self, data: bytes) -> None:
+		"""
+		Dump the encoded health check message to file for collection
+		:param data: encoded health check message
+		"""
+		# write to a temporary file and rename it, so the collector never reads a partial file
+		with open(self._tmp_path, 'wb') as dump_file:
+			dump_file.write(data)
+		os.replace(self._tmp_path, self._dump_path)
+
+	def run_check(
+			self, check: Tuple[Callable, str, str], *, timestamp: Optional[float] = None
+	) -> Dict:
 		"""
 		Run the health check function
-		:param check: a registered health check function
+		:param check: a registered health check as (function, name, prefixed name for logging)
+		:param timestamp: time of the health check cycle, defaults to the time the check finished
 		:return:
 		"""
-		start_time = time.time()
+		function, name, log_name = check
+		start_time = time.perf_counter()
 
 		try:
-			passed, output = check()
+			passed, output = function()
 		except Exception as exc:
 			logger.warning(exc)
 			passed, output = False, str(exc)
 
-		end_time = time.time()
+		end_time = time.perf_counter()
 		elapsed_time = end_time - start_time
 		# Reduce to 6 decimal points to have consistency with timestamp
-		elapsed_time = float(f"{elapsed_time:.6f}")
+		elapsed_time = round(elapsed_time, 6)
+		if timestamp is None:
+			timestamp = time.time()
 
 		if passed:
-			logger.debug("Health check %s.%s passed", self.prefix, check.__name__)
+			if logger.isEnabledFor(logging.DEBUG):
+				logger.debug("Health check %s passed", log_name)
 		else:
-			logger.error("Health check %s.%s failed with output %s", self.prefix, check.__name__, output)
-
-		timestamp = time.time()
+			logger.error("Health check %s failed with output %s", log_name, output)
 
 		result = {
-			'checker': check.__name__,
+			'checker': name,
 			'output': output,
 			'passed': passed,
 			'timestamp': timestamp,
@@ -165,30 +247,34 @@ class HealthCheck(threading.Timer):
 		}
 		return result
 
-	def check_periodic_checkin(self) -> Dict:
+	def check_periodic_checkin(self, *, timestamp: Optional[float] = None) -> Dict:
 		"""
 		Check if the periodic checkin is within the timeout
+		:param timestamp: time of the health check cycle, defaults to now
 		"""
-		periodic_check = {
-			'checker': self.prefix + '-periodic-checkin',
-			'output': '',
-			'passed': False,
-			'timestamp': time.time(),
-			'response_time': 0,
-		}
-
-		time_diff = time.time() - self._latest_checkin
-		if time_diff > self.timeout:
-			periodic_check['passed'] = False
+		if timestamp is None:
+			timestamp = time.time()
+		checker = self.prefix + '-periodic-checkin'
+		time_diff = timestamp - self._latest_checkin
+		passed = time_diff <= self.timeout
+		if passed:
+			if logger.isEnabledFor(logging.DEBUG):
+				logger.debug("Health check %s.%s passed", self.prefix, checker)
+		else:
 			logger.error(
 				"Health check %s.%s failed with time diff %f",
 				self.prefix,
-				periodic_check['checker'],
+				checker,
 				time_diff
 			)
-		else:
-			periodic_check['passed'] = True
-			logger.debug("Health check %s.%s passed", self.prefix, periodic_check['checker'])
+
+		periodic_check = {
+			'checker': checker,
+			'output': '',
+			'passed': passed,
+			'timestamp': timestamp,
+			'response_time': 0,
+		}
 		return periodic_check
 
 	def live(self) -> None:
@@ -208,13 +294,16 @@ def create_health_check(caller: str = None, timeout: int = 0) -> HealthCheck:
 	:param timeout: timeout in seconds
 	:return: HealthCheck object
 	"""
-	stack = inspect.stack()
 	if caller is None:
-		if stack[2][0].f_locals.get(
-				"self") is None:  # 2 because 0 is this function, 1 is init_check and 2 is the caller
-			caller = stack[2][0].f_locals['__name__']
+		# 2 because 0 is this function, 1 is init_check and 2 is the caller
+		try:
+			frame = sys._getframe(2)  # pylint: disable=protected-access
+		except ValueError:  # called directly from the outermost frame
+			frame = sys._getframe(1)  # pylint: disable=protected-access
+		if frame.f_locals.get("self") is None:
+			caller = frame.f_globals['__name__']
 		else:
-			caller = stack[2][0].f_locals["self"].__class__.__name__
+			caller = frame.f_locals["self"].__class__.__name__
 	check = HealthCheck(prefix=caller, interval=RUN_PERIOD, timeout=timeout)
 	return check
 
@@ -20,16 +20,22 @@ import sys
 import threading
 import time
 import urllib
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Callable, Tuple, Dict, Any
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Tuple, Dict, Any, List, Optional
 from wsgiref.handlers import SimpleHandler
 
+from healthcheck_python import codec
 from healthcheck_python.release import __version__
 
 __all__ = ['WSGIServer', 'WSGIRequestHandler', 'make_server', 'start_http_server']
 
 SERVER_VERSION = "WSGIServer/" + __version__
 
+HOSTNAME = socket.gethostname()
+
+# health and liveness results are collected in a single pass and reused for this many seconds
+SNAPSHOT_TTL = 1.0
+
 
 def json_output_handler(results, passed: bool):
 	"""
@@ -39,7 +45,7 @@ def json_output_handler(results, passed: bool):
 	:return: JSON output
 	"""
 	data = {
-		'hostname': socket.gethostname(),
+		'hostname': HOSTNAME,
 		'status': 'success' if passed else 'failure',
 		'timestamp': time.time(),
 		'results': results,
@@ -54,7 +60,7 @@ def json_liveness_handler(liveness: bool):
 	:return: JSON output
 	"""
 	data = {
-		'hostname': socket.gethostname(),
+		'hostname': HOSTNAME,
 		'liveness': liveness,
 		'timestamp': time.time(),
 	}
@@ -67,6 +73,9 @@ class HealthCollector:
 	"""
 
 	def __init__(self):
+		self._snapshot = None
+		self._snapshot_ts = 0.0
+		self._files: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
 		self._dump_dir = os.environ.get('PY_HEALTH_MULTIPROC_DIR', None)
 		if self._dump_dir:
 			if not os.path.exists(self._dump_dir):
@@ -78,34 +87,85 @@ class HealthCollector:
 				logging.warning("PY_HEALTH_MULTIPROC_DIR is not a directory, healthcheck will not work")
 				self._dump_dir = None
 
-	def health(self) -> Tuple[bool, Dict[str, Any]]:
+	def _dump_files(self) -> List[os.DirEntry]:
 		"""
-		Collects the results of the health checks
-		:return: health check results
+		List the health check files in the dump directory
+		:return: directory entries of the health check files
 		"""
-		if not self._dump_dir:
-			return False, {'status': 'failure', 'message': 'PY_HEALTH_MULTIPROC_DIR not set'}
+		with os.scandir(self._dump_dir) as entries:
+			return [entry for entry in entries if entry.name.endswith(codec.EXTENSIONS) and entry.is_file()]
+
+	def _load(self, entry: os.DirEntry, files: Dict) -> Optional[Dict[str, Any]]:
+		"""
+		Load a health check file. The decoded content is reused while the file is unchanged
+		:param entry: directory entry of the health check file
+		:param files: decoded files of the current refresh, keyed by path
+		:return: a copy of the decoded health check file, None if it can not be decoded
+		"""
+		stat = entry.stat()
+		key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+		cached = self._files.get(entry.path)
+		if cached is None or cached[0] != key:
+			with open(entry.path, 'rb') as dump_file:
+				try:
+					cached = (key, codec.loads(dump_file.read(), os.path.splitext(entry.name)[1]))
+				except codec.DECODE_ERRORS:
+					return None
+
+		files[entry.path] = cached
+		return dict(cached[1])
 
+	def _refresh(self) -> None:
+		"""
+		Read all health check files once and build both the health and liveness results
+		"""
+		now = time.time()
 		results = []
 		statuses = []
-		for file in os.listdir(self._dump_dir):
-			with open(os.path.join(self._dump_dir, file), 'r') as json_file:
-				try:
-					data = json.load(json_file)
-				except json.JSONDecodeError:
-					continue
+		liveness = []
+		files = {}
+		for entry in self._dump_files():
+			data = self._load(entry, files)
+			if data is None:
+				continue
 
 			if data['timeout'] == 0:
 				status = data['status']
 			else:
-				status = (time.time() - data['timestamp'] < data['timeout']) and data['status']
+				status = (now - data['timestamp'] < data['timeout']) and data['status']
 				data['status'] = status
 
 			statuses.append(status)
 			results.append(data)
+			liveness.append(data['liveness'])
 
 		overall_status = all(statuses)
-		return overall_status, json_output_handler(results, overall_status)
+		overall_liveness = all(liveness)
+		self._snapshot = (
+			(overall_status, json_output_handler(results, overall_status)),
+			(overall_liveness, json_liveness_handler(overall_liveness)),
+		)
+		self._snapshot_ts = time.monotonic()
+		self._files = files
+
+	def _collect(self) -> Tuple[Tuple[bool, Dict[str, Any]], Tuple[bool, Dict[str, Any]]]:
+		"""
+		Get the latest health and liveness results, refreshing them if they are older than SNAPSHOT_TTL
+		:return: health and liveness check results
+		"""
+		if self._snapshot is None or time.monotonic() - self._snapshot_ts > SNAPSHOT_TTL:
+			self._refresh()
+		return self._snapshot
+
+	def health(self) -> Tuple[bool, Dict[str, Any]]:
+		"""
+		Collects the results of the health checks
+		:return: health check results
+		"""
+		if not self._dump_dir:
+			return False, {'status': 'failure', 'message': 'PY_HEALTH_MULTIPROC_DIR not set'}
+
+		return self._collect()[0]
 
 	def liveness(self) -> Tuple[bool, Dict[str, Any]]:
 		"""
@@ -116,30 +176,26 @@ class HealthCollector:
 		if not self._dump_dir:
 			return False, {'liveness': 'failure', 'message': 'PY_HEALTH_MULTIPROC_DIR not set'}
 
-		liveness = []
-		for file in os.listdir(self._dump_dir):
-			with open(os.path.join(self._dump_dir, file), 'r') as json_file:
-				try:
-					data = json.load(json_file)
-				except json.JSONDecodeError:
-					continue
+		return self._collect()[1]
 
-			liveness.append(data['liveness'])
 
-		overall_liveness = all(liveness)
-		return overall_liveness, json_liveness_handler(overall_liveness)
-
-
-class WSGIServer(HTTPServer):
-	"""BaseHTTPServer that implements the Python WSGI protocol"""
+class WSGIServer(ThreadingHTTPServer):
+	"""
+	ThreadingHTTPServer that implements the Python WSGI protocol.
+	Each request is handled in its own thread.
+	"""
 
 	applications = {}
 
+	def __init__(self, *args, **kwargs):
+		self.responders: Dict[str, Callable] = {}
+		super().__init__(*args, **kwargs)
+
 	def server_bind(self):
 		"""
 		Override server_bind to store the server name.
 		"""
-		HTTPServer.server_bind(self)
+		ThreadingHTTPServer.server_bind(self)
 		self.setup_environ()
 
 	def setup_environ(self):
@@ -171,6 +227,22 @@ class WSGIServer(HTTPServer):
 		"""
 		self.applications[path] = application
 
+	def get_responder(self, path: str) -> Callable:
+		"""
+		Get the JSON responder for the given path.
+		:param path: URI path
+		:return: responder
+		"""
+		return self.responders.get(path)
+
+	def set_responder(self, path: str, responder: Callable) -> None:
+		"""
+		Set the JSON responder for the given path. Responders are served without WSGI.
+		:param path: URI path
+		:param responder: a function that returns the status and the encoded JSON body
+		"""
+		self.responders[path] = responder
+
 
 class WSGIRequestHandler(BaseHTTPRequestHandler):
 	"""
@@ -225,6 +297,21 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
 		"""
 		return sys.stderr
 
+	def send_json(self, status: bool, body: bytes) -> None:
+		"""
+		Send a JSON response with a single write.
+		:param status: health status, sent as 200 if True and 500 otherwise
+		:param body: encoded JSON body
+		"""
+		code = 200 if status else 500
+		head = (
+			f"{self.protocol_version} {code} {self.responses[code][0]}\r\n"
+			f"Date: {self.date_time_string()}\r\n"
+			"Content-Type: application/json\r\n"
+			f"Content-Length: {len(body)}\r\n\r\n"
+		)
+		self.wfile.write(head.encode("latin-1") + body)
+
 	def handle(self):
 		"""
 		Handle a single HTTP request.
@@ -241,29 +328,64 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
 			return
 
 		path = self.path
+		responder = self.server.get_responder(path)
+		if responder is not None:
+			try:
+				status, body = responder()
+			except Exception:
+				logging.exception("Health check request %s failed", path)
+				self.send_error(500)
+				return
+			self.send_json(status, body)
+			return
+
 		output = self.server.get_app(path)
 
 		if output is not None:
 			handler = SimpleHandler(
 				self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
-				multithread=False,
+				multithread=True,
 			)
 			handler.request_handler = self  # backpointer for logging
 			handler.run(output)
 
 
+def make_responder(app: Callable) -> Callable:
+	"""
+	Converts a health check function into a function that returns the status and the encoded JSON body.
+	:param app: health check function
+	:return: responder
+	"""
+
+	# the collector returns the same output object until its snapshot is refreshed,
+	# so the encoded body of the last output is reused
+	last = (None, b"")
+
+	def responder() -> Tuple[bool, bytes]:
+		nonlocal last
+		status, output = app()
+		last_output, body = last
+		if output is not last_output:
+			body = json.dumps(output).encode("utf-8")
+			last = (output, body)
+		return status, body
+
+	return responder
+
+
 def make_wsgi_app(app: Callable) -> Callable:
 	"""
 	Converts a health check function into a WSGI application.
 	:param app: health check function
 	:return: WSGI application
 	"""
+	responder = make_responder(app)
 
 	def health_app(_, start_response):
-		status, output = app()
+		status, body = responder()
 		status_str = "200 OK" if status else "500 Internal Server Error"
 		start_response(status_str, [('Content-Type', 'application/json')])
-		return [json.dumps(output).encode("utf-8")]
+		return [body]
 
 	return health_app
 
@@ -278,11 +400,8 @@ def make_server(host, port, app):
 	"""
 	server = WSGIServer((host, port), WSGIRequestHandler)
 
-	app_health = make_wsgi_app(app.health)
-	server.set_app("/healthcheck", app_health)
-
-	app_liveness = make_wsgi_app(app.liveness)
-	server.set_app("/liveness", app_liveness)
+	server.set_responder("/healthcheck", make_responder(app.health))
+	server.set_responder("/liveness", make_responder(app.liveness))
 	return server
 
 